@@ -1,13 +1,71 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from fastapi.responses import StreamingResponse
-from ...services.file_service import FileService
-from io import BytesIO
-from typing import Literal, List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form, Request
+from fastapi.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+from ...services.cache_service import CacheService
+from ...services.file_service import FileService, remove_work_dir
+from os import getenv, path
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+from typing import Final, Literal, List
 
 router = APIRouter(prefix="/pdf", tags=["PDF Operations"])
-file_service = FileService()
+file_service = FileService(gs_workers=int(getenv("PDF_GS_WORKERS", 0)))
+cache_service = CacheService(
+    getenv("PDF_CACHE_DIR", "/var/cache/pdfsvc"),
+    int(getenv("PDF_CACHE_SIZE", 1024 * 1024 * 1024)),
+)
+
+accepted_quality: Final[dict[str, str]] = {
+    "extreme": "screen",
+    "normal": "ebook",
+    "low": "printer",
+}
+
+MAX_UPLOAD_SIZE = int(getenv("PDF_MAX_UPLOAD_SIZE", 100 * 1024 * 1024))
+PDF_MAGIC = b"%PDF-"
+
+
+def check_upload_size(size: int | None):
+    if size and size > MAX_UPLOAD_SIZE:
+        raise HTTPException(413, f"Upload exceeds {MAX_UPLOAD_SIZE} bytes")
+
+
+async def is_pdf(file: UploadFile) -> bool:
+    header = await file.read(len(PDF_MAGIC))
+    await file.seek(0)
+
+    return header == PDF_MAGIC
 
-accepted_quality = {"extreme": "screen", "normal": "ebook", "low": "printer"}
+
+class WorkDirFileResponse(FileResponse):
+    def __init__(self, file_path: str, work_dir: str, **kwargs):
+        super().__init__(file_path, **kwargs)
+        self.work_dir = work_dir
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # background tasks are skipped when the client disconnects mid-send
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            remove_work_dir(self.work_dir)
+
+
+@asynccontextmanager
+async def gs_slot(request: Request):
+    gs_sem: asyncio.Semaphore = request.app.state.gs_sem
+
+    try:
+        await asyncio.wait_for(
+            gs_sem.acquire(), timeout=request.app.state.gs_queue_timeout
+        )
+    except TimeoutError:
+        raise HTTPException(503, "Server is busy, try again later")
+
+    try:
+        yield
+    finally:
+        gs_sem.release()
 
 
 @router.post(
@@ -16,44 +74,85 @@ accepted_quality = {"extreme": "screen", "normal": "ebook", "low": "printer"}
     description="Compress a PDF file with specified quality level",
 )
 async def pdf_compressor(
+    request: Request,
     file: UploadFile = File(..., description="PDF file to compress"),
     quality: Literal["extreme", "normal", "low"] = Form(
         ...,
         description="Compression level: extreme (max compression), normal (balanced), low (min compression)",
     ),
+    cache: bool = Form(False, description="Reuse the result for identical uploads"),
 ):
     try:
-        if file.content_type != "application/pdf":
+        check_upload_size(file.size)
+
+        if file.content_type != "application/pdf" or not await is_pdf(file):
             raise HTTPException(400, "File type is incorrect")
 
-        pdf_bytes = await file.read()
-        compressed_file: bytes
+        compressed_path: str | None = None
+        cache_key: str | None = None
         actual_size = file.size
 
-        compressed_file = file_service.compress_pdf_tmp(
-            pdf_bytes, accepted_quality[quality]
-        )
-
-        if not compressed_file:
-            raise HTTPException(500, "Compression did not generate any results")
-
-        file_name = file.filename.removesuffix(".pdf")
-        compressed_size = len(compressed_file)
-        reduction = ((actual_size - compressed_size) / actual_size) * 100
+        if cache:
+            try:
+                cache_key = await asyncio.to_thread(
+                    cache_service.key, file.file, quality
+                )
+                compressed_path = await asyncio.to_thread(
+                    cache_service.get, cache_key, actual_size
+                )
+            except Exception as e:
+                logging.warning(f"PDF cache lookup failed, treating as miss: {e}")
+                await file.seek(0)
+
+        cache_hit = compressed_path is not None
+        if cache_hit:
+            compressed = path.getsize(compressed_path) < actual_size
+        else:
+            async with gs_slot(request):
+                compressed_path, compressed = await asyncio.to_thread(
+                    file_service.compress_pdf_stream,
+                    file.file,
+                    accepted_quality[quality],
+                    actual_size,
+                )
 
-        return StreamingResponse(
-            BytesIO(compressed_file),
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f'attachment; filename="{file_name}_compress.pdf"',
-                "Content-Length": str(len(compressed_file)),
-                "X-Original-Size": str(actual_size),
-                "X-Compressed-size": str(compressed_size),
-                "X-Reduction-Percent": f"{reduction:.2f}",
-                "X-Quality-Level": quality,
-                "X-Compressed-Filename": f"{file_name}_compress.pdf",
-            },
-        )
+        work_dir = path.dirname(compressed_path)
+
+        try:
+            compressed_size = path.getsize(compressed_path)
+            if not compressed_size:
+                raise HTTPException(500, "Compression did not generate any results")
+
+            if cache_key and not cache_hit:
+                try:
+                    await asyncio.to_thread(
+                        cache_service.set, cache_key, compressed_path
+                    )
+                except Exception as e:
+                    logging.warning(f"PDF cache store failed: {e}")
+
+            file_name = f"{file.filename.removesuffix('.pdf')}_compress.pdf"
+            reduction = ((actual_size - compressed_size) / actual_size) * 100
+
+            return WorkDirFileResponse(
+                compressed_path,
+                work_dir,
+                media_type="application/pdf",
+                filename=file_name,
+                headers={
+                    "X-Original-Size": str(actual_size),
+                    "X-Compressed-size": str(compressed_size),
+                    "X-Reduction-Percent": f"{reduction:.2f}",
+                    "X-Quality-Level": quality,
+                    "X-Compressed-Filename": file_name,
+                    "X-Compression-Skipped": "0" if compressed else "1",
+                },
+            )
+        except Exception:
+            remove_work_dir(work_dir)
+            raise
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -62,37 +161,46 @@ async def pdf_compressor(
     "/merge", summary="Merge PDFs", description="Merge multiple PDF files into one"
 )
 async def pdf_merge(
+    request: Request,
     files: List[UploadFile] = File(
         ..., description="List of PDF files to merge (minimum 2)"
     ),
 ):
     try:
+        check_upload_size(sum(f.size or 0 for f in files))
+
         if len(files) < 2:
             raise HTTPException(
                 status_code=400, detail="At least 2 PDF files are required for merging."
             )
 
         for file in files:
-            if file.content_type != "application/pdf":
+            if file.content_type != "application/pdf" or not await is_pdf(file):
                 raise HTTPException(
                     status_code=400,
                     detail=f"Invalid file type: {file.filename} must be a PDF.",
                 )
 
-        bytes_list = [await f.read() for f in files]
+        async with gs_slot(request):
+            merged_path = await asyncio.to_thread(
+                file_service.merge_pdf_mem,
+                [f.file for f in files],
+                sum(f.size or 0 for f in files),
+            )
 
-        merged_file = file_service.merge_pdf(bytes_list)
+        work_dir = path.dirname(merged_path)
 
-        if not merged_file:
+        if not path.getsize(merged_path):
+            remove_work_dir(work_dir)
             raise HTTPException(500, "Merge did not generate any results")
 
-        return StreamingResponse(
-            BytesIO(merged_file),
+        return WorkDirFileResponse(
+            merged_path,
+            work_dir,
             media_type="application/pdf",
-            headers={
-                "Content-Disposition": 'attachment; filename="merged.pdf"',
-                "Content-Length": str(len(merged_file)),
-            },
+            filename="merged.pdf",
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
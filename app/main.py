@@ -1,5 +1,17 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from .api.v1 import api_pdf
+from .services.file_service import MAX_CONCURRENCY, sweep_work_dirs
+from os import getenv
+from contextlib import asynccontextmanager
+import asyncio
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(sweep_work_dirs)
+    yield
+
 
 app = FastAPI(
     title="PDF Microservice",
@@ -7,6 +19,26 @@ app = FastAPI(
     version="0.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
+app.state.gs_sem = asyncio.Semaphore(MAX_CONCURRENCY)
+app.state.gs_queue_timeout = float(getenv("PDF_QUEUE_TIMEOUT", 30))
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # runs before FastAPI reads and spools the multipart body
+    content_length = request.headers.get("content-length", "")
+
+    if content_length.isdigit() and int(content_length) > api_pdf.MAX_UPLOAD_SIZE:
+        return ORJSONResponse(
+            {"detail": f"Upload exceeds {api_pdf.MAX_UPLOAD_SIZE} bytes"},
+            status_code=413,
+        )
+
+    return await call_next(request)
+
+
 app.include_router(prefix="/api/v1", router=api_pdf.router)
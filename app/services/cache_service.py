@@ -0,0 +1,55 @@
+from typing import BinaryIO
+from os import path
+from blake3 import blake3
+from diskcache import Cache
+from .file_service import CHUNK_SIZE, make_work_dir, remove_work_dir
+import shutil
+
+
+class CacheService:
+    def __init__(self, directory: str, size_limit: int):
+        self.directory = directory
+        self.size_limit = size_limit
+        self._cache: Cache | None = None
+
+    @property
+    def cache(self) -> Cache:
+        if self._cache is None:
+            self._cache = Cache(
+                self.directory,
+                size_limit=self.size_limit,
+                eviction_policy="least-recently-used",
+            )
+
+        return self._cache
+
+    def key(self, src_stream: BinaryIO, quality: str) -> str:
+        hasher = blake3()
+        while chunk := src_stream.read(CHUNK_SIZE):
+            hasher.update(chunk)
+        src_stream.seek(0)
+
+        return f"{hasher.hexdigest()}:{quality}"
+
+    def get(self, key: str, size: int | None = None) -> str | None:
+        cached_file = self.cache.get(key, read=True)
+        if cached_file is None:
+            return None
+
+        # copy from the open handle so a concurrent eviction cannot pull
+        # the file out from under the response
+        work_dir = make_work_dir(size)
+        output_path = path.join(work_dir, "out.pdf")
+
+        try:
+            with cached_file, open(output_path, "wb") as output_file:
+                shutil.copyfileobj(cached_file, output_file, length=CHUNK_SIZE)
+        except Exception:
+            remove_work_dir(work_dir)
+            raise
+
+        return output_path
+
+    def set(self, key: str, file_path: str) -> None:
+        with open(file_path, "rb") as file:
+            self.cache.set(key, file, read=True)
@@ -1,231 +1,649 @@
-from typing import List
-from os import path, unlink
+from typing import BinaryIO, Final, List
+from dataclasses import dataclass
+from os import cpu_count, environ, getenv, path, replace
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, time
+import glob
+import queue
+import shutil
 import subprocess
 import tempfile
+import threading
 import logging
+import pikepdf
 
+CHUNK_SIZE = 1 << 20
+PDF_TMPDIR = getenv("PDF_TMPDIR") or ("/dev/shm" if path.isdir("/dev/shm") else None)
+# a work dir holds the input, the output and parts or a qpdf copy
+WORK_DIR_SIZE_FACTOR = 3
+# work dirs left behind by a crashed or killed worker process
+STALE_WORK_DIR_AGE = 60 * 60
+PARALLEL_MIN_PAGES = 40
+# gunicorn takes its default worker count from WEB_CONCURRENCY, each worker
+# gets an equal share of the cores
+CPU_SHARE = max(1, (cpu_count() or 1) // int(getenv("WEB_CONCURRENCY", 1)))
+MAX_CONCURRENCY = int(getenv("PDF_MAX_CONCURRENCY", CPU_SHARE))
+# page-range jobs cannot carry these over, so such documents are never sharded
+SHARD_BLOCKING_KEYS = ("/Outlines", "/AcroForm", "/Dests")
+MIN_COMPRESS_SIZE = 64 * 1024
+SIZE_GUARD_RATIO = 0.98
 
-class FileService:
-    def compress_pdf_buffer(self, pdf_bytes: bytes, quality: str) -> bytes:
-        logging.debug(
-            f"Compressing {len(pdf_bytes)} bytes with quality={quality} in buffer"
+# pdfwrite params shared by the gs command line and GhostscriptWorker jobs
+GS_PDFWRITE_PARAMS: Final[dict[str, str]] = {
+    "CompatibilityLevel": "1.7",
+    "DetectDuplicateImages": "true",
+    "RemoveDuplicateImages": "true",
+    "RemoveOPComments": "true",
+    "CompressFonts": "true",
+    "SubsetFonts": "true",
+    "CompressPages": "true",
+    "EmbedAllFonts": "true",
+    "DownsampleColorImages": "true",
+    "ColorImageDownsampleType": "/Bicubic",
+    "AutoFilterColorImages": "false",
+    "ColorImageFilter": "/DCTEncode",
+    "DownsampleGrayImages": "true",
+    "GrayImageDownsampleType": "/Bicubic",
+    "AutoFilterGrayImages": "false",
+    "GrayImageFilter": "/DCTEncode",
+    "DownsampleMonoImages": "true",
+    "MonoImageDownsampleType": "/Bicubic",
+    "DiscardComments": "true",
+    "DiscardDocInfo": "true",
+}
+
+# read by the PDF interpreter, so a worker takes them at startup
+GS_INTERPRETER_PARAMS: Final[dict[str, str]] = {
+    "FilterTextAnnotations": "true",
+    "FilterImageAnnotations": "true",
+}
+
+GS_BASE_ARGS: tuple[str, ...] = (
+    "gs",
+    "-sDEVICE=pdfwrite",
+    "-dNOPAUSE",
+    "-dQUIET",
+    "-dBATCH",
+    *(f"-d{key}={value}" for key, value in GS_PDFWRITE_PARAMS.items()),
+    *(f"-d{key}={value}" for key, value in GS_INTERPRETER_PARAMS.items()),
+)
+
+GS_RENDERING_THREADS = min(4, MAX_CONCURRENCY)
+GS_USER_PARAMS = "<< /MaxBitmap 50000000 >> setuserparams"
+
+GS_DISTILLER_PARAMS = " ".join(
+    f"/{key} {value}" for key, value in GS_PDFWRITE_PARAMS.items()
+)
+GS_WORKER_DONE = b"PDFSVC_DONE"
+GS_WORKER_FAILED = b"PDFSVC_FAILED"
+
+
+@dataclass(frozen=True, slots=True)
+class QualityProfile:
+    mono: int
+    color: int
+    gray: int
+
+
+# image resolution per gs PDFSETTINGS preset
+QUALITY_PROFILES: Final[dict[str, QualityProfile]] = {
+    "printer": QualityProfile(mono=600, color=150, gray=150),
+    "ebook": QualityProfile(mono=300, color=96, gray=96),
+    "screen": QualityProfile(mono=150, color=72, gray=72),
+}
+
+# presets that only need structural recompression, no image resampling
+PIKEPDF_QUALITIES = frozenset({"ebook", "printer"})
+
+# lossy or image-specific codecs that are left untouched by pikepdf
+IMAGE_FILTERS = frozenset(
+    {"/DCTDecode", "/JPXDecode", "/CCITTFaxDecode", "/JBIG2Decode"}
+)
+
+pikepdf.settings.set_flate_compression_level(9)
+
+QPDF_COMPRESS_ARGS = (
+    "--stream-data=compress",
+    "--object-streams=generate",
+    "--compress-streams=y",
+    "--compression-level=9",
+)
+
+QPDF_JOIN_ARGS = ("--decrypt", "--remove-info", "--remove-metadata")
+
+# zopfli needs qpdf >= 11.10 built with zopfli support, see QPDF_ZOPFLI
+ZOPFLI_ENABLED = getenv("PDF_ZOPFLI", "0") == "1"
+ZOPFLI_QUALITIES = frozenset({"screen"})
+
+
+def temp_dir_for(size: int | None) -> str | None:
+    if not PDF_TMPDIR or not size:
+        return None
+
+    if size * WORK_DIR_SIZE_FACTOR > shutil.disk_usage(PDF_TMPDIR).free:
+        return None
+
+    return PDF_TMPDIR
+
+
+def make_work_dir(size: int | None = None) -> str:
+    return tempfile.mkdtemp(prefix="pdfsvc_", dir=temp_dir_for(size))
+
+
+def remove_work_dir(work_dir: str) -> None:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def sweep_work_dirs(max_age: float = STALE_WORK_DIR_AGE) -> None:
+    cutoff = time() - max_age
+
+    for base in {d for d in (PDF_TMPDIR, tempfile.gettempdir()) if d}:
+        for work_dir in glob.glob(path.join(base, "pdfsvc_*")):
+            try:
+                if path.getmtime(work_dir) < cutoff:
+                    logging.debug(f"Removing stale work dir {work_dir}")
+                    remove_work_dir(work_dir)
+            except OSError:
+                continue
+
+
+# caps running gs processes per worker process, page-range jobs included
+GS_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+
+def ps_string(value: str) -> str:
+    escaped = value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"({escaped})"
+
+
+class GhostscriptWorker:
+    def __init__(self):
+        permitted = {d for d in (PDF_TMPDIR, tempfile.gettempdir()) if d}
+        self.process = subprocess.Popen(
+            [
+                "gs",
+                "-q",
+                "-dNOPAUSE",
+                "-dNODISPLAY",
+                "-sstdout=%stderr",
+                *(f"-d{key}={value}" for key, value in GS_INTERPRETER_PARAMS.items()),
+                *(f"--permit-file-all={path.join(d, '*')}" for d in permitted),
+                "-c",
+                GS_USER_PARAMS,
+                "-f",
+                "-",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
         )
+        self.lines: queue.Queue[bytes] = queue.Queue()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
 
-        gs_cmd = [
-            "gs",
-            "-sDEVICE=pdfwrite",
-            "-dCompatibilityLevel=1.4",
-            f"-dPDFSETTINGS=/{quality}",
-            "-dNOPAUSE",
-            "-dQUIET",
-            "-dBATCH",
-            "-dDetectDuplicateImages=true",
-            "-dRemoveOPComments=true",
-            "-dCompressFonts=true",
-            "-dDiscardComments=true",
-            "-dDiscardDocInfo=true",
-            "-dFILTERTEXTANNOTATIONS=true",
-            "-dFILTERIMAGEANNOTATIONS=true",
-            "-sOutputFile=-",
-            "-",
-        ]
-        gs_process: subprocess.Popen = None
+        # jobs read the PDFSETTINGS presets from here, fail now rather than
+        # compressing every request without them
+        try:
+            self.run(
+                "systemdict /.distillersettings known "
+                f"{{ ({GS_WORKER_DONE.decode()}) }} "
+                f"{{ ({GS_WORKER_FAILED.decode()} .distillersettings missing) }} "
+                "ifelse = flush\n",
+                timeout=10,
+            )
+        except Exception:
+            self.close()
+            raise
+
+    def _read_stderr(self) -> None:
+        for line in self.process.stderr:
+            self.lines.put(line)
+        self.lines.put(b"")
+
+    def run(self, job: str, timeout: float) -> None:
+        self.process.stdin.write(job.encode())
+        self.process.stdin.flush()
+
+        deadline = monotonic() + timeout
+        output: List[bytes] = []
+
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0, deadline - monotonic()))
+            except queue.Empty:
+                raise subprocess.TimeoutExpired("gs", timeout)
+
+            if not line:
+                raise RuntimeError("Ghostscript worker exited unexpectedly")
+
+            line = line.strip()
+            if line == GS_WORKER_DONE:
+                return
+            if line.startswith(GS_WORKER_FAILED):
+                message = b"\n".join((*output, line)).decode("utf-8", "ignore")
+                raise RuntimeError(f"Error to compress file: {message}")
+
+            output.append(line)
+
+    def close(self) -> None:
+        self.process.kill()
+        self.process.wait()
+
+
+class GhostscriptWorkerPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: queue.Queue[GhostscriptWorker] = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> bool:
+        with self._lock:
+            if not self._started:
+                self._started = True
+                workers: List[GhostscriptWorker] = []
+
+                try:
+                    for _ in range(self.size):
+                        workers.append(GhostscriptWorker())
+                except Exception as e:
+                    for worker in workers:
+                        worker.close()
+                    self.size = 0
+                    logging.error(
+                        f"Ghostscript worker pool failed to start, using one-shot gs: {e}"
+                    )
+                else:
+                    for worker in workers:
+                        self._idle.put(worker)
+
+            return self.size > 0
+
+    def compress(
+        self, input_path: str, output_path: str, quality: str, timeout: float = 60
+    ) -> None:
+        with GS_SLOTS:
+            try:
+                worker = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise subprocess.TimeoutExpired("gs", timeout)
+
+            try:
+                worker.run(self._build_job(input_path, output_path, quality), timeout)
+            except Exception:
+                # a failed job can leave gs mid-file, never hand it out again
+                worker.close()
+                self._replace()
+                raise
+
+            self._idle.put(worker)
 
+    def _replace(self) -> None:
         try:
-            gs_process = subprocess.Popen(
-                gs_cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+            worker = GhostscriptWorker()
+        except Exception as e:
+            with self._lock:
+                self.size -= 1
+            logging.error(
+                f"Ghostscript worker restart failed, pool size {self.size}: {e}"
             )
+            return
 
-            gs_output, gs_err = gs_process.communicate(input=pdf_bytes, timeout=60)
-            if gs_process.returncode != 0:
-                raise RuntimeError(
-                    f"Error to compress file: {gs_err.decode('utf-8', 'ignore')}"
-                )
+        self._idle.put(worker)
+
+    def _build_job(self, input_path: str, output_path: str, quality: str) -> str:
+        profile = QUALITY_PROFILES[quality]
+
+        return (
+            "save /pdfsvc_save exch def {\n"
+            f"<< /OutputDevice /pdfwrite /OutputFile {ps_string(output_path)} >> "
+            "setpagedevice\n"
+            f".distillersettings /{quality} get setdistillerparams\n"
+            f"<< {GS_DISTILLER_PARAMS} /ColorImageResolution {profile.color} "
+            f"/GrayImageResolution {profile.gray} "
+            f"/MonoImageResolution {profile.mono} >> "
+            "setdistillerparams\n"
+            f"{ps_string(input_path)} run\n"
+            "} stopped\n"
+            f"{{ clear $error /errorname get pdfsvc_save restore "
+            f"({GS_WORKER_FAILED.decode()} ) print == flush }}\n"
+            f"{{ pdfsvc_save restore ({GS_WORKER_DONE.decode()}) = flush }} ifelse\n"
+        )
+
+
+class FileService:
+    def __init__(self, gs_workers: int = 0):
+        self.gs_pool = GhostscriptWorkerPool(gs_workers) if gs_workers > 0 else None
+
+    def compress_pdf_stream(
+        self, src_stream: BinaryIO, quality: str, size: int | None = None
+    ) -> tuple[str, bool]:
+        logging.debug(f"Compressing stream with quality={quality} in tmp disk")
+
+        work_dir = make_work_dir(size)
+
+        try:
+            input_path = self._spool(src_stream, path.join(work_dir, "in.pdf"))
+            input_size = path.getsize(input_path)
+
+            if input_size < MIN_COMPRESS_SIZE:
+                return input_path, False
+
+            output_path = path.join(work_dir, "out.pdf")
+            self._compress(input_path, output_path, quality)
+
+            if path.getsize(output_path) >= input_size * SIZE_GUARD_RATIO:
+                logging.debug(f"Keeping original {input_size} bytes, no size gain")
+                return input_path, False
 
-            if not gs_output:
-                raise RuntimeError("Compression failed: no output generated")
+            return output_path, True
 
-            return gs_output
-        except subprocess.TimeoutExpired:
-            if gs_process:
-                gs_process.kill()
-                gs_process.wait()
-            raise RuntimeError("Compression took too long")
+        except subprocess.TimeoutExpired as e:
+            remove_work_dir(work_dir)
+            raise RuntimeError(f"Compression timeout: {str(e)}")
         except Exception as e:
+            remove_work_dir(work_dir)
             raise RuntimeError(f"Unexpected error: {str(e)}")
 
-    def compress_pdf_tmp(self, pdf_bytes: bytes, quality: str) -> bytes:
+    def _compress(self, input_path: str, output_path: str, quality: str) -> None:
+        if quality in PIKEPDF_QUALITIES:
+            self.compress_pdf_pikepdf(input_path, output_path)
+            return
+
+        n_workers = MAX_CONCURRENCY
+        page_count = self._shardable_page_count(input_path) if n_workers > 1 else 0
+
+        if page_count >= PARALLEL_MIN_PAGES:
+            self.compress_pdf_parallel(
+                input_path, output_path, quality, n_workers, page_count
+            )
+        elif ZOPFLI_ENABLED and quality in ZOPFLI_QUALITIES:
+            self._compress_pipeline(input_path, output_path, quality)
+        else:
+            if self.gs_pool and self.gs_pool.start():
+                self.gs_pool.compress(input_path, output_path, quality)
+            else:
+                self._run_gs(input_path, output_path, quality)
+
+            if self._has_uncompressed_streams(output_path):
+                self._run_qpdf(output_path, quality)
+
+    def compress_pdf_pikepdf(self, input_path: str, output_path: str) -> None:
+        with pikepdf.open(input_path) as pdf:
+            for obj in pdf.objects:
+                if not isinstance(obj, pikepdf.Stream):
+                    continue
+
+                filters = obj.get("/Filter")
+                if filters is None:
+                    continue
+                if isinstance(filters, pikepdf.Name):
+                    filters = [filters]
+
+                filter_names = {str(f) for f in filters}
+                if filter_names & IMAGE_FILTERS or filter_names == {"/FlateDecode"}:
+                    continue
+
+                try:
+                    obj.write(obj.read_bytes())
+                except pikepdf.PdfError:
+                    continue
+
+            pdf.save(
+                output_path,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                compress_streams=True,
+                recompress_flate=True,
+                linearize=True,
+            )
+
+    def compress_pdf_parallel(
+        self,
+        input_path: str,
+        output_path: str,
+        quality: str,
+        n_workers: int,
+        page_count: int | None = None,
+    ) -> None:
+        if page_count is None:
+            page_count = self._count_pages(input_path)
+
+        n_workers = max(1, min(n_workers, cpu_count() or 1, page_count))
+        step = -(-page_count // n_workers)
+        page_ranges = [
+            (first_page, min(first_page + step - 1, page_count))
+            for first_page in range(1, page_count + 1, step)
+        ]
         logging.debug(
-            f"Compressing {len(pdf_bytes)} bytes with quality={quality} in tmp disk"
+            f"Compressing {page_count} pages with quality={quality} "
+            f"in {len(page_ranges)} parallel gs jobs"
         )
 
-        input_path = None
-        output_path = None
-        output_compress_path = None
+        work_dir = path.dirname(output_path)
+        part_paths = [
+            path.join(work_dir, f"part_{i}.pdf") for i in range(len(page_ranges))
+        ]
 
-        try:
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as input_file:
-                input_file.write(pdf_bytes)
-                input_path = input_file.name
-
-            with tempfile.NamedTemporaryFile(
-                suffix="_gs.pdf", delete=False
-            ) as output_file:
-                output_path = output_file.name
-
-            with tempfile.NamedTemporaryFile(
-                suffix="_qpdf.pdf", delete=False
-            ) as output_compress_file:
-                output_compress_path = output_compress_file.name
-
-            mono_quality = 300
-            color_image_quality = 96
-            gray_image_quality = 96
-
-            match quality:
-                case "printer":
-                    mono_quality = 600
-                    color_image_quality = 150
-                    gray_image_quality = 150
-                case "ebook":
-                    mono_quality = 300
-                    color_image_quality = 96
-                    gray_image_quality = 96
-                case "screen":
-                    mono_quality = 150
-                    color_image_quality = 72
-                    gray_image_quality = 72
-
-            gs_cmd = [
-                "gs",
-                "-sDEVICE=pdfwrite",
-                "-dCompatibilityLevel=1.7",
-                f"-dPDFSETTINGS=/{quality}",
-                "-dNOPAUSE",
-                "-dQUIET",
-                "-dBATCH",
-                "-dDetectDuplicateImages=true",
-                "-dRemoveDuplicateImages=true",
-                "-dRemoveOPComments=true",
-                "-dCompressFonts=true",
-                "-dSubsetFonts=true",
-                "-dCompressPages=true",
-                "-dEmbedAllFonts=true",
-                "-dDownsampleColorImages=true",
-                f"-dColorImageResolution={color_image_quality}",
-                "-dColorImageDownsampleType=/Bicubic",
-                "-dAutoFilterColorImages=false",
-                "-dColorImageFilter=/DCTEncode",
-                "-dDownsampleGrayImages=true",
-                f"-dGrayImageResolution={gray_image_quality}",
-                "-dGrayImageDownsampleType=/Bicubic",
-                "-dAutoFilterGrayImages=false",
-                "-dGrayImageFilter=/DCTEncode",
-                "-dDownsampleMonoImages=true",
-                f"-dMonoImageResolution={mono_quality}",
-                "-dMonoImageDownsampleType=/Bicubic",
-                "-dDiscardComments=true",
-                "-dDiscardDocInfo=true",
-                "-dFilterTextAnnotations=true",
-                "-dFilterImageAnnotations=true",
-                f"-sOutputFile={output_path}",
-                input_path,
+        with ThreadPoolExecutor(max_workers=len(page_ranges)) as executor:
+            futures = [
+                executor.submit(
+                    self._run_gs, input_path, part_path, quality, first, last
+                )
+                for part_path, (first, last) in zip(part_paths, page_ranges)
             ]
+            for future in futures:
+                future.result()
 
-            gs_process = subprocess.run(
-                gs_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60
+        qpdf_args, qpdf_env = self._qpdf_compress_options(quality)
+        # keep the input's catalog but drop what pdfwrite drops on one-shot gs
+        qpdf_cmd = [
+            "qpdf",
+            *qpdf_args,
+            *QPDF_JOIN_ARGS,
+            input_path,
+            "--pages",
+            *part_paths,
+            "--",
+            output_path,
+        ]
+        qpdf_process = subprocess.run(
+            qpdf_cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=60,
+            env=qpdf_env,
+        )
+
+        if qpdf_process.returncode != 0:
+            raise RuntimeError(
+                f"Error merging compressed parts: {qpdf_process.stderr.decode('utf-8', 'ignore')}"
             )
 
+    def _spool(self, src_stream: BinaryIO, input_path: str) -> str:
+        with open(input_path, "wb") as input_file:
+            shutil.copyfileobj(src_stream, input_file, length=CHUNK_SIZE)
+
+        return input_path
+
+    def _count_pages(self, input_path: str) -> int:
+        with pikepdf.open(input_path) as pdf:
+            return len(pdf.pages)
+
+    def _shardable_page_count(self, input_path: str) -> int:
+        with pikepdf.open(input_path) as pdf:
+            names = pdf.Root.get("/Names")
+            if any(key in pdf.Root for key in SHARD_BLOCKING_KEYS) or (
+                names is not None and "/Dests" in names
+            ):
+                return 0
+
+            return len(pdf.pages)
+
+    def _compress_pipeline(
+        self, input_path: str, output_path: str, quality: str
+    ) -> None:
+        gs_process: subprocess.Popen = None
+        qpdf_process: subprocess.Popen = None
+        qpdf_args, qpdf_env = self._qpdf_compress_options(quality)
+
+        with tempfile.TemporaryFile() as gs_err, GS_SLOTS:
+            try:
+                gs_process = subprocess.Popen(
+                    self._build_gs_cmd(input_path, "-", quality),
+                    stdout=subprocess.PIPE,
+                    stderr=gs_err,
+                )
+                qpdf_process = subprocess.Popen(
+                    ["qpdf", *qpdf_args, "-", output_path],
+                    stdin=gs_process.stdout,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    env=qpdf_env,
+                )
+                gs_process.stdout.close()
+
+                _, qpdf_err = qpdf_process.communicate(timeout=60)
+                gs_process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                for process in (gs_process, qpdf_process):
+                    if process:
+                        process.kill()
+                        process.wait()
+                raise
+
             if gs_process.returncode != 0:
+                gs_err.seek(0)
                 raise RuntimeError(
-                    f"Error to compress file: {gs_process.stderr.decode('utf-8', 'ignore')}"
+                    f"Error to compress file: {gs_err.read().decode('utf-8', 'ignore')}"
                 )
 
-            qpdf_cmd = [
-                "qpdf",
-                "--stream-data=compress",
-                "--object-streams=generate",
-                "--compress-streams=y",
-                "--compression-level=9",
-                output_path,
-                output_compress_path,
-            ]
-            qpdf_process = subprocess.run(
-                qpdf_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60
-            )
-
             if qpdf_process.returncode != 0:
                 raise RuntimeError(
-                    f"Error to compress file: {qpdf_process.stderr.decode('utf-8', 'ignore')}"
+                    f"Error to compress file: {qpdf_err.decode('utf-8', 'ignore')}"
                 )
 
-            with open(output_compress_path, "rb") as file:
-                return file.read()
+    def _has_uncompressed_streams(self, pdf_path: str) -> bool:
+        with pikepdf.open(pdf_path) as pdf:
+            return any(
+                isinstance(obj, pikepdf.Stream) and "/Filter" not in obj
+                for obj in pdf.objects
+            )
 
-        except subprocess.TimeoutExpired as e:
-            raise RuntimeError(f"Compression timeout: {str(e)}")
-        except Exception as e:
-            raise RuntimeError(f"Unexpected error: {str(e)}")
-        finally:
-            for file_path in (input_path, output_path, output_compress_path):
-                if file_path and path.exists(file_path):
-                    try:
-                        unlink(file_path)
-                    except Exception:
-                        pass
+    def _run_qpdf(self, pdf_path: str, quality: str) -> None:
+        qpdf_args, qpdf_env = self._qpdf_compress_options(quality)
+        output_path = path.join(path.dirname(pdf_path), "qpdf.pdf")
 
-    def merge_pdf(self, bytes_list: List[bytes]):
-        input_paths = []
-        output_path = None
+        qpdf_process = subprocess.run(
+            ["qpdf", *qpdf_args, pdf_path, output_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=60,
+            env=qpdf_env,
+        )
 
-        try:
-            for i, pdf_bytes in enumerate(bytes_list):
-                with tempfile.NamedTemporaryFile(
-                    suffix=f"_{i}.pdf", delete=False
-                ) as input_file:
-                    input_file.write(pdf_bytes)
-                    input_paths.append(input_file.name)
-
-            with tempfile.NamedTemporaryFile(
-                suffix="_gs.pdf", delete=False
-            ) as output_file:
-                output_path = output_file.name
-
-            qpdf_cmd = [
-                "qpdf",
-                "--linearize",
-                "--empty",
-                "--pages",
-                *input_paths,
-                "--",
-                output_path,
-                "--object-streams=generate",
-                "--compress-streams=y",
-                "--recompress-flate",
-            ]
-            qpdf_process = subprocess.run(
-                qpdf_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60
+        if qpdf_process.returncode != 0:
+            raise RuntimeError(
+                f"Error to compress file: {qpdf_process.stderr.decode('utf-8', 'ignore')}"
             )
 
-            if qpdf_process.returncode != 0:
-                raise RuntimeError(
-                    f"Error merging PDFs: {qpdf_process.stderr.decode('utf-8', 'ignore')}"
+        replace(output_path, pdf_path)
+
+    def _qpdf_compress_options(
+        self, quality: str
+    ) -> tuple[List[str], dict[str, str] | None]:
+        if ZOPFLI_ENABLED and quality in ZOPFLI_QUALITIES:
+            return [*QPDF_COMPRESS_ARGS, "--recompress-flate"], {
+                **environ,
+                "QPDF_ZOPFLI": "1",
+            }
+
+        return list(QPDF_COMPRESS_ARGS), None
+
+    def _run_gs(
+        self,
+        input_path: str,
+        output_path: str,
+        quality: str,
+        first_page: int | None = None,
+        last_page: int | None = None,
+    ) -> None:
+        with GS_SLOTS:
+            gs_process = subprocess.run(
+                self._build_gs_cmd(
+                    input_path, output_path, quality, first_page, last_page
+                ),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                timeout=60,
+            )
+
+        if gs_process.returncode != 0:
+            raise RuntimeError(
+                f"Error to compress file: {gs_process.stderr.decode('utf-8', 'ignore')}"
+            )
+
+    def _build_gs_cmd(
+        self,
+        input_path: str,
+        output_path: str,
+        quality: str,
+        first_page: int | None = None,
+        last_page: int | None = None,
+    ) -> List[str]:
+        profile = QUALITY_PROFILES[quality]
+
+        gs_cmd = [
+            *GS_BASE_ARGS,
+            f"-dPDFSETTINGS=/{quality}",
+            f"-dColorImageResolution={profile.color}",
+            f"-dGrayImageResolution={profile.gray}",
+            f"-dMonoImageResolution={profile.mono}",
+            f"-sOutputFile={output_path}",
+        ]
+
+        if output_path == "-":
+            gs_cmd.append("-sstdout=%stderr")
+        if first_page is not None:
+            gs_cmd.append(f"-dFirstPage={first_page}")
+        if last_page is not None:
+            gs_cmd.append(f"-dLastPage={last_page}")
+
+        # page-range jobs already run one gs per core
+        sharded = first_page is not None or last_page is not None
+        rendering_threads = 1 if sharded else GS_RENDERING_THREADS
+        gs_cmd.append(f"-dNumRenderingThreads={rendering_threads}")
+
+        gs_cmd.extend(("-c", GS_USER_PARAMS, "-f", input_path))
+
+        return gs_cmd
+
+    def merge_pdf_mem(
+        self, src_streams: List[BinaryIO], size: int | None = None
+    ) -> str:
+        work_dir = make_work_dir(size)
+        sources: List[pikepdf.Pdf] = []
+
+        try:
+            output_path = path.join(work_dir, "out.pdf")
+
+            with pikepdf.new() as merged:
+                for src_stream in src_streams:
+                    source = pikepdf.open(src_stream)
+                    sources.append(source)
+                    merged.pages.extend(source.pages)
+
+                merged.save(
+                    output_path,
+                    linearize=True,
+                    object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                    compress_streams=True,
+                    recompress_flate=True,
                 )
 
-            with open(output_path, "rb") as merged:
-                return merged.read()
+            return output_path
 
-        except subprocess.TimeoutExpired:
-            raise RuntimeError("Merge operation timed out")
         except Exception as e:
+            remove_work_dir(work_dir)
             raise RuntimeError(f"Unexpected error during merge: {str(e)}")
         finally:
-            for p in input_paths + ([output_path] if output_path else []):
-                if p and path.exists(p):
-                    try:
-                        unlink(p)
-                    except Exception:
-                        pass
+            for source in sources:
+                source.close()
@@ -0,0 +1,50 @@
+from io import BytesIO
+import os
+import pikepdf
+import pytest
+from fastapi.testclient import TestClient
+from app.api.v1 import api_pdf
+from app.main import app
+from app.services import file_service
+from app.services.cache_service import CacheService
+
+
+def build_pdf(pages: int = 1, content: bytes = b"") -> bytes:
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+        if content:
+            pdf.pages[-1].Contents = pdf.make_stream(content)
+
+    buffer = BytesIO()
+    pdf.save(buffer, compress_streams=False)
+
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def work_root(tmp_path, monkeypatch):
+    work_root = tmp_path / "work"
+    work_root.mkdir()
+    monkeypatch.setattr(file_service, "PDF_TMPDIR", str(work_root))
+
+    return work_root
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(
+        api_pdf, "cache_service", CacheService(str(cache_dir), 1024 * 1024 * 1024)
+    )
+
+    return cache_dir
+
+
+@pytest.fixture
+def client(work_root, cache_dir):
+    return TestClient(app)
+
+
+def list_work_dirs(work_root) -> list[str]:
+    return [name for name in os.listdir(work_root) if name.startswith("pdfsvc_")]
@@ -0,0 +1,147 @@
+import os
+import pikepdf
+import pytest
+from fastapi import HTTPException
+from app.api.v1 import api_pdf
+from app.services.cache_service import CacheService
+from app.services.file_service import MIN_COMPRESS_SIZE
+from conftest import build_pdf, list_work_dirs
+
+
+def compress(client, source: bytes, **data):
+    return client.post(
+        "/api/v1/pdf/compress",
+        files={"file": ("doc.pdf", source, "application/pdf")},
+        data={"quality": "normal", **data},
+    )
+
+
+def test_compress_skips_small_files(client, work_root):
+    source = build_pdf()
+
+    response = compress(client, source)
+
+    assert response.status_code == 200
+    assert response.headers["X-Compression-Skipped"] == "1"
+    assert response.headers["X-Compressed-Filename"] == "doc_compress.pdf"
+    assert response.content == source
+    assert list_work_dirs(work_root) == []
+
+
+def test_compress_skips_without_size_gain(client, work_root):
+    source = build_pdf(content=os.urandom(MIN_COMPRESS_SIZE * 2))
+
+    response = compress(client, source)
+
+    assert response.status_code == 200
+    assert response.headers["X-Compression-Skipped"] == "1"
+    assert response.headers["X-Reduction-Percent"] == "0.00"
+    assert response.content == source
+    assert list_work_dirs(work_root) == []
+
+
+def test_compress_returns_smaller_file(client, work_root):
+    source = build_pdf(content=b"0 0 m 1 1 l S\n" * 10000)
+
+    response = compress(client, source)
+
+    assert response.status_code == 200
+    assert response.headers["X-Compression-Skipped"] == "0"
+    assert int(response.headers["X-Compressed-size"]) == len(response.content)
+    assert len(response.content) < len(source)
+    assert list_work_dirs(work_root) == []
+
+
+def test_compress_rejects_bad_magic(client):
+    response = compress(client, b"not a pdf at all")
+
+    assert response.status_code == 400
+
+
+def test_merge_rejects_bad_magic(client):
+    response = client.post(
+        "/api/v1/pdf/merge",
+        files=[
+            ("files", ("a.pdf", build_pdf(), "application/pdf")),
+            ("files", ("b.pdf", b"not a pdf at all", "application/pdf")),
+        ],
+    )
+
+    assert response.status_code == 400
+
+
+def test_oversized_content_length_is_rejected_before_the_body(client, monkeypatch):
+    monkeypatch.setattr(api_pdf, "MAX_UPLOAD_SIZE", 1024)
+    monkeypatch.setattr(
+        api_pdf.file_service,
+        "compress_pdf_stream",
+        lambda *args: pytest.fail("handler should not run"),
+    )
+
+    response = compress(client, build_pdf(content=b"x" * 2048))
+
+    assert response.status_code == 413
+
+
+def test_check_upload_size_rejects_parsed_size(monkeypatch):
+    monkeypatch.setattr(api_pdf, "MAX_UPLOAD_SIZE", 1024)
+
+    api_pdf.check_upload_size(None)
+    api_pdf.check_upload_size(1024)
+    with pytest.raises(HTTPException) as error:
+        api_pdf.check_upload_size(1025)
+
+    assert error.value.status_code == 413
+
+
+def test_compress_cache_miss_store_hit(client, work_root, monkeypatch):
+    source = build_pdf(content=b"0 0 m 1 1 l S\n" * 10000)
+    compress_pdf_stream = api_pdf.file_service.compress_pdf_stream
+    calls = []
+
+    def counting_compress(*args):
+        calls.append(args)
+        return compress_pdf_stream(*args)
+
+    monkeypatch.setattr(api_pdf.file_service, "compress_pdf_stream", counting_compress)
+
+    miss = compress(client, source, cache="true")
+    hit = compress(client, source, cache="true")
+
+    assert miss.status_code == hit.status_code == 200
+    assert len(calls) == 1
+    assert hit.content == miss.content
+    assert hit.headers["X-Compression-Skipped"] == "0"
+    assert list_work_dirs(work_root) == []
+
+
+def test_compress_treats_cache_failure_as_miss(client, tmp_path, monkeypatch):
+    not_a_dir = tmp_path / "cache_file"
+    not_a_dir.write_bytes(b"")
+    monkeypatch.setattr(
+        api_pdf, "cache_service", CacheService(str(not_a_dir), 1024 * 1024)
+    )
+    source = build_pdf(content=b"0 0 m 1 1 l S\n" * 10000)
+
+    response = compress(client, source, cache="true")
+
+    assert response.status_code == 200
+    assert response.headers["X-Compression-Skipped"] == "0"
+    assert len(response.content) < len(source)
+
+
+def test_merge_returns_all_pages_and_removes_work_dir(client, work_root, tmp_path):
+    response = client.post(
+        "/api/v1/pdf/merge",
+        files=[
+            ("files", ("a.pdf", build_pdf(pages=2), "application/pdf")),
+            ("files", ("b.pdf", build_pdf(pages=3), "application/pdf")),
+        ],
+    )
+
+    assert response.status_code == 200
+    merged_path = tmp_path / "merged.pdf"
+    merged_path.write_bytes(response.content)
+    with pikepdf.open(merged_path) as pdf:
+        assert len(pdf.pages) == 5
+    assert list_work_dirs(work_root) == []
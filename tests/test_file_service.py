@@ -0,0 +1,114 @@
+from io import BytesIO
+import os
+import tempfile
+import pikepdf
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from app.services.file_service import FileService, IMAGE_FILTERS, MIN_COMPRESS_SIZE
+from conftest import build_pdf, list_work_dirs
+
+
+def test_compress_pdf_stream_passes_small_files_through(work_root):
+    source = build_pdf()
+    assert len(source) < MIN_COMPRESS_SIZE
+
+    output_path, compressed = FileService().compress_pdf_stream(
+        BytesIO(source), "screen", len(source)
+    )
+
+    assert not compressed
+    assert output_path.startswith(str(work_root))
+    with open(output_path, "rb") as output:
+        assert output.read() == source
+
+
+def test_compress_pdf_stream_keeps_original_without_size_gain(work_root):
+    source = build_pdf(content=os.urandom(MIN_COMPRESS_SIZE * 2))
+
+    output_path, compressed = FileService().compress_pdf_stream(
+        BytesIO(source), "ebook", len(source)
+    )
+
+    assert not compressed
+    assert os.path.basename(output_path) == "in.pdf"
+    with open(output_path, "rb") as output:
+        assert output.read() == source
+
+
+def test_compress_pdf_stream_returns_smaller_output(work_root):
+    source = build_pdf(pages=2, content=b"0 0 m 1 1 l S\n" * 10000)
+
+    output_path, compressed = FileService().compress_pdf_stream(
+        BytesIO(source), "ebook", len(source)
+    )
+
+    assert compressed
+    assert os.path.basename(output_path) == "out.pdf"
+    assert os.path.getsize(output_path) < len(source)
+    with pikepdf.open(output_path) as pdf:
+        assert len(pdf.pages) == 2
+
+
+def test_compress_pdf_pikepdf_leaves_image_codecs_alone(tmp_path):
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    payloads = {name: os.urandom(256) for name in sorted(IMAGE_FILTERS)}
+    for name, payload in payloads.items():
+        stream = pdf.make_stream(payload)
+        stream.Filter = pikepdf.Name(name)
+        pdf.Root[f"/Test{name[1:]}"] = stream
+    hex_stream = pdf.make_stream(b"48656c6c6f>")
+    hex_stream.Filter = pikepdf.Name.ASCIIHexDecode
+    pdf.Root.TestHex = hex_stream
+    input_path = tmp_path / "in.pdf"
+    output_path = tmp_path / "out.pdf"
+    pdf.save(input_path)
+
+    FileService().compress_pdf_pikepdf(str(input_path), str(output_path))
+
+    with pikepdf.open(output_path) as pdf:
+        for name, payload in payloads.items():
+            stream = pdf.Root[f"/Test{name[1:]}"]
+            assert stream.Filter == pikepdf.Name(name)
+            assert stream.read_raw_bytes() == payload
+        assert pdf.Root.TestHex.Filter == pikepdf.Name.FlateDecode
+        assert pdf.Root.TestHex.read_bytes() == b"Hello"
+
+
+def test_merge_pdf_mem_concatenates_pages(work_root):
+    sources = [build_pdf(pages=2), build_pdf(pages=3)]
+
+    output_path = FileService().merge_pdf_mem(
+        [BytesIO(source) for source in sources], sum(map(len, sources))
+    )
+
+    with pikepdf.open(output_path) as pdf:
+        assert len(pdf.pages) == 5
+
+
+def test_merge_pdf_mem_removes_work_dir_on_error(work_root):
+    with pytest.raises(RuntimeError):
+        FileService().merge_pdf_mem(
+            [BytesIO(build_pdf()), BytesIO(b"%PDF-broken")], 1024
+        )
+
+    assert list_work_dirs(work_root) == []
+
+
+def test_sweep_work_dirs_runs_on_startup_only(work_root, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(work_root))
+    stale_dir = work_root / "pdfsvc_stale"
+    stale_dir.mkdir()
+    os.utime(stale_dir, (0, 0))
+    fresh_dir = work_root / "pdfsvc_fresh"
+    fresh_dir.mkdir()
+
+    TestClient(app)
+    assert stale_dir.exists()
+
+    with TestClient(app):
+        pass
+
+    assert not stale_dir.exists()
+    assert fresh_dir.exists()
@@ -0,0 +1,69 @@
+from app.services import file_service
+from app.services.file_service import (
+    FileService,
+    GS_BASE_ARGS,
+    GS_DISTILLER_PARAMS,
+    GS_PDFWRITE_PARAMS,
+    GS_WORKER_DONE,
+    GS_WORKER_FAILED,
+    GhostscriptWorkerPool,
+    ps_string,
+)
+
+
+def test_ps_string_escapes_delimiters():
+    assert ps_string("plain.pdf") == "(plain.pdf)"
+    assert ps_string("a(b)c.pdf") == r"(a\(b\)c.pdf)"
+    assert ps_string("back\\slash.pdf") == r"(back\\slash.pdf)"
+    assert ps_string("\\)") == r"(\\\))"
+
+
+def test_distiller_params_match_command_line():
+    for key, value in GS_PDFWRITE_PARAMS.items():
+        assert f"-d{key}={value}" in GS_BASE_ARGS
+        assert f"/{key} {value}" in GS_DISTILLER_PARAMS
+
+
+def test_build_job():
+    pool = GhostscriptWorkerPool(1)
+    job = pool._build_job("/tmp/in (1).pdf", "/tmp/out\\1.pdf", "screen")
+
+    assert r"/OutputFile (/tmp/out\\1.pdf)" in job
+    assert r"(/tmp/in \(1\).pdf) run" in job
+    assert ".distillersettings /screen get setdistillerparams" in job
+    assert "/ColorImageResolution 72" in job
+    assert "/GrayImageResolution 72" in job
+    assert "/MonoImageResolution 150" in job
+    assert f"({GS_WORKER_DONE.decode()})" in job
+    assert f"({GS_WORKER_FAILED.decode()} )" in job
+    assert job.endswith("ifelse\n")
+
+    unescaped = job.replace("\\(", "").replace("\\)", "")
+    assert unescaped.count("{") == unescaped.count("}")
+    assert unescaped.count("(") == unescaped.count(")")
+    assert unescaped.count("<<") == unescaped.count(">>")
+
+
+def test_pool_start_failure_falls_back_to_one_shot_gs(monkeypatch):
+    starts = []
+    one_shot = []
+
+    def failing_worker():
+        starts.append(1)
+        raise RuntimeError("gs not found")
+
+    monkeypatch.setattr(file_service, "GhostscriptWorker", failing_worker)
+    monkeypatch.setattr(file_service, "ZOPFLI_ENABLED", False)
+    monkeypatch.setattr(FileService, "_shardable_page_count", lambda *args: 0)
+    monkeypatch.setattr(FileService, "_has_uncompressed_streams", lambda *args: False)
+    monkeypatch.setattr(
+        FileService, "_run_gs", lambda self, *args: one_shot.append(args)
+    )
+    service = FileService(gs_workers=2)
+
+    for _ in range(2):
+        service._compress("in.pdf", "out.pdf", "screen")
+
+    assert service.gs_pool.size == 0
+    assert len(starts) == 1
+    assert one_shot == [("in.pdf", "out.pdf", "screen")] * 2